@@ -6,54 +6,63 @@ Created on Wed Nov  6 07:48:14 2019
 """
 import matplotlib.pyplot as plt
 import pandas as pd
+import numpy as np
 import math
-import seaborn as sns
 
 pd.options.plotting.backend = 'matplotlib'
 HIGHLIGHT_COLOR = 'purple' # Standard in my organization, but you can customize this
 
 def plot_values_above_bar(data, display_values=None, ax=None, strfmt='.2f', orient='v',
-                          textcolor='black', bar_nr=None, nr_bars=None):
+                          textcolor='black', bar_nr=None, nr_bars=None, lim=None):
     '''
     Helper function to display values above (or on) bar plot)
     
     Parameters
     ----------
-    data: the series containing the position of the labels
+    data: the series containing the position of the labels, or a dataframe with one
+          column per bar series when the plot contains multiple bar charts
     display_values: Optionally: the values to display if different from data
     ax: Axis object on which the labels should be plotted
     strfmt: the format-string for the labels
     orient: "v"(ertical) bars or "h"(orizontal) bars
     bar_nr: if the plot contains multiple bar charts, which of the series we want to label
     nr_bars: if the plot contains multiple bar charts, how many series are shown in total
+    lim: optionally the (min, max) limits of the value axis, to avoid looking them up on ax
+         again when labelling multiple series on the same axis one by one
     '''
     if (bar_nr is None) != (nr_bars is None):
         raise ValueError('Either both bar_nr and nr_bars should be None, or neither')
+    if isinstance(data, pd.DataFrame) and bar_nr is not None:
+        raise ValueError('bar_nr and nr_bars can only be given when data is a Series')
     
     display_values = data if display_values is None else display_values
     if ax is None:
         ax = plt.gca()
     
     if orient == 'v':
-        lim_min, lim_max = ax.get_xlim()
+        get_lim = ax.get_xlim
         va = 'center'
         ha = 'left'
     elif orient == 'h':
-        lim_min, lim_max = ax.get_ylim()
+        get_lim = ax.get_ylim
         va = 'bottom'
         ha = 'center'
     else:
         raise ValueError(f'orient must be "v" or "h", not {orient}')
+    lim_min, lim_max = get_lim() if lim is None else lim
     plotsize = lim_max - lim_min 
     
-    for i, (v, dv) in enumerate(zip(data, display_values)):
-        v += 0.025 * plotsize # offset label little bit
-        if nr_bars is not None:
-            i += -0.5 + 1/(nr_bars+2) * (bar_nr + 1)
-        
-        x = v if orient == 'v' else i
-        y = i if orient == 'v' else v
-        label = '{:{prec}}'.format(dv, prec=strfmt)
+    values = np.asarray(data, dtype=float) + 0.025 * plotsize # offset label little bit
+    positions = np.arange(len(values), dtype=float)
+    if values.ndim == 2:
+        nr_cols = values.shape[1]
+        positions = positions[:, None] + (-0.5 + 1/(nr_cols+2) * (np.arange(nr_cols) + 1))
+    elif nr_bars is not None:
+        positions += -0.5 + 1/(nr_bars+2) * (bar_nr + 1)
+    
+    xs, ys = (values, positions) if orient == 'v' else (positions, values)
+    labels = [format(dv, strfmt) for dv in np.asarray(display_values).ravel()]
+    for x, y, label in zip(xs.ravel(), ys.ravel(), labels):
         ax.text(x, y, label, color=textcolor, va=va, ha=ha)
     
 
@@ -75,20 +84,31 @@ def plot_waterfall(data, color=None, buildup=False, **kwargs):
     '''
     if color is None:
         color = ['lightgray'] * len(data)
+    elif isinstance(color, str):
+        raise TypeError('color should be a list with a color for each bar, not a string')
+    elif len(color) != len(data):
+        raise ValueError(f'color should contain {len(data)} colors, one for each bar, '
+                         f'not {len(color)}')
+    bar_colors = list(color) + ['gray'] # new list, so it can be reversed in place below
 
     # taken from https://pbpython.com/waterfall-chart.html
-    blank = data.cumsum().shift(1).fillna(0)
+    # blank is the cumsum shifted by one; pandas' cumsum skips missing values
+    cumsum = data.cumsum().to_numpy(dtype=float, na_value=np.nan)
+    blank = np.zeros_like(cumsum)
+    blank[1:] = cumsum[:-1]
+    blank[np.isnan(blank)] = 0 # as fillna(0) did: cumsum is NaN at a missing value
+    blank = pd.Series(blank, index=data.index, name=data.name)
     total = data.sum()
-    data.loc['total'] = total
-    blank.loc['total'] = 0
-    color = color + ['gray']
+    # concat instead of .loc assignment so the caller's series is not modified
+    data = pd.concat([data, pd.Series([total], index=['total'], name=data.name)])
+    blank = pd.concat([blank, pd.Series([0], index=['total'], name=blank.name)])
     
     if buildup:
         data = data[::-1]
         blank = blank[::-1]
-        color = color[::-1]
+        bar_colors.reverse()
     
-    ax = data.plot(kind='barh', stacked=True, left=blank, color=color, **kwargs)
+    ax = data.plot(kind='barh', stacked=True, left=blank, color=bar_colors, **kwargs)
     return ax, data, blank
 
 def define_colors(highlight, data, plottype):
@@ -106,27 +126,41 @@ def define_colors(highlight, data, plottype):
     color: list of len(data) with colors and appropriate highlights
     '''
     if isinstance(data, pd.Series) or plottype == 'scatter':
-        color = ['lightgray'] * len(data)
+        n = len(data)
     elif isinstance(data, pd.DataFrame):
-        color = ['lightgray'] * data.shape[1]
+        n = data.shape[1]
     else:
         raise TypeError('data should be of type DataFrame or Series')
-    try:
-        for h in highlight:
-            if h < 0: 
-                h = len(data) + h
-            color[h] = HIGHLIGHT_COLOR
-    except TypeError:
-        color[highlight] = HIGHLIGHT_COLOR
-    return color
+    highlight = np.atleast_1d(highlight)
+    if highlight.size and not np.issubdtype(highlight.dtype, np.integer):
+        raise TypeError(f'highlight should be an integer or list of integers, not {highlight.dtype}')
+    color = np.full(n, 'lightgray', dtype=object)
+    color[highlight.astype(np.int64)] = HIGHLIGHT_COLOR # numpy handles negative indices
+    return color.tolist()
 
 def is_percentage_series(series):
     '''
     Checks whether a series contains all percentages
     
-    By checking whether all values are between 0 and 1, and the sum is equal to 1
+    By checking whether the sum is equal to 1 (cheap, so checked first), and all values are
+    between 0 and 1
+    '''
+    if not math.isclose(series.sum(), 1):
+        return False
+    if series.hasnans:
+        # between treats NaN as out of range, but skips pd.NA in nullable dtypes
+        return bool(series.between(0, 1).all())
+    return bool(series.min() >= 0 and series.max() <= 1)
+
+def is_percentage_frame(df):
+    '''
+    Checks whether all columns of a dataframe contain percentages
+    
+    Equivalent to applying is_percentage_series to every column, but uses frame-wide reductions
+    instead of a Python call per column
     '''
-    return series.between(0, 1).all() and math.isclose(series.sum(), 1)
+    return bool(np.allclose(df.sum().to_numpy(dtype=float), 1, rtol=1e-9, atol=0) and
+                ((df >= 0) & (df <= 1)).all(axis=None))
 
 def pick_plottype(data):
     '''
@@ -140,23 +174,107 @@ def pick_plottype(data):
     Returns
     -------
     plottype: string of plottype to be used by micompanyify
+    is_pct: whether the data contains percentages, or None if this was not needed to
+            determine the plottype
     '''
+    is_pct = None
     if isinstance(data.index, pd.DatetimeIndex):
         if len(data) < 10:
             plottype = 'bar_timeseries'
         else:
             plottype = 'line_timeseries'
     elif isinstance(data, pd.Series):
-        if is_percentage_series(data):
+        is_pct = is_percentage_series(data)
+        if is_pct:
             plottype = 'waterfall'
         else:
             plottype = 'bar'
     elif isinstance(data, pd.DataFrame):
-        if data.apply(is_percentage_series).all():
+        is_pct = is_percentage_frame(data)
+        if is_pct:
             plottype = 'composition_comparison'
         else:
             plottype = 'scatter'
-    return plottype
+    return plottype, is_pct
+
+def _plot_labelled_bars(data, color, strfmt, orient, kind, **kwargs):
+    '''Shared implementation of the bar plottypes: plots data as kind of bar and labels the bars'''
+    ax = data.plot(kind=kind, color=color, **kwargs)
+    plot_values_above_bar(data, ax=ax, orient=orient, strfmt=strfmt)
+    return ax
+
+def _plot_bar(data, color, strfmt, orient, highlight, **kwargs):
+    '''Plots the 'bar' plottype: horizontal bars'''
+    return _plot_labelled_bars(data, color, strfmt, orient, kind='barh', **kwargs)
+
+def _plot_bar_timeseries(data, color, strfmt, orient, highlight, **kwargs):
+    '''Plots the 'bar_timeseries' plottype: vertical bars'''
+    return _plot_labelled_bars(data, color, strfmt, orient, kind='bar', **kwargs)
+
+def _plot_labelled_waterfall(data, color, strfmt, orient, buildup, **kwargs):
+    '''Shared implementation of the waterfall plottypes: plots a waterfall and labels the bars'''
+    # Read once per call rather than at import, so switching backends afterwards still works
+    backend = kwargs.get('backend', pd.options.plotting.backend)
+    ax, data, blank = plot_waterfall(data, color=color, buildup=buildup, **kwargs)
+    if backend == 'matplotlib':
+        plot_values_above_bar((data+blank), data, ax=ax, strfmt=strfmt, orient=orient)
+    return ax
+
+def _plot_waterfall(data, color, strfmt, orient, highlight, **kwargs):
+    '''Plots the 'waterfall' plottype: a builddown waterfall'''
+    return _plot_labelled_waterfall(data, color, strfmt, orient, buildup=False, **kwargs)
+
+def _plot_waterfall_buildup(data, color, strfmt, orient, highlight, **kwargs):
+    '''Plots the 'waterfall_buildup' plottype: a buildup waterfall'''
+    return _plot_labelled_waterfall(data, color, strfmt, orient, buildup=True, **kwargs)
+
+def _plot_line_timeseries(data, color, strfmt, orient, highlight, **kwargs):
+    '''Plots the 'line_timeseries' plottype'''
+    return data.plot(color=color, **kwargs)
+
+def _plot_scatter(data, color, strfmt, orient, highlight, **kwargs):
+    '''Plots the 'scatter' plottype: the third column, if any, determines the size'''
+    import seaborn as sns # only needed here and slow to import
+    x = data.iloc[:, 0]
+    y = data.iloc[:, 1]
+    try:
+        size = data.iloc[:, 2]
+    except IndexError:
+        size = None
+    return sns.scatterplot(x=x, y=y, size=size, color='grey', **kwargs)
+
+def _plot_composition_comparison(data, color, strfmt, orient, highlight, **kwargs):
+    '''Plots the 'composition_comparison' plottype: stacked bars, labelling the highlight'''
+    # Wrap the transposed array (a view) instead of data.transpose(), which may copy
+    transposed = pd.DataFrame(data.to_numpy().T, index=data.columns, columns=data.index, copy=False)
+    ax = transposed.plot(kind='barh', stacked=True, color=color, **kwargs)
+    location = data.cumsum() - data.div(2) # middle of each stacked bar
+    if not isinstance(highlight, int):
+        raise TypeError('Can only highlight one line in composition comparison')
+
+    plot_values_above_bar(location.iloc[highlight, :], data.iloc[highlight, :],
+                          textcolor='white', ax=ax, orient=orient, strfmt=strfmt)
+    return ax
+
+def _plot_piechart(data, color, strfmt, orient, highlight, **kwargs):
+    '''Refuses the 'piechart' plottype'''
+    raise TypeError('A piechart? Are you kidding me?')
+
+# Maps every plottype to the function that draws it; each function is called with
+# (data, color, strfmt, orient, highlight, **kwargs) and returns the axis object
+_DISPATCH = {'bar': _plot_bar,
+             'bar_timeseries': _plot_bar_timeseries,
+             'waterfall': _plot_waterfall,
+             'waterfall_buildup': _plot_waterfall_buildup,
+             'line_timeseries': _plot_line_timeseries,
+             'scatter': _plot_scatter,
+             'composition_comparison': _plot_composition_comparison,
+             'piechart': _plot_piechart,
+             }
+
+# Value axis ticks are hidden for plottypes that already label their values
+_HIDE_XTICKS = {'bar', 'waterfall', 'waterfall_buildup', 'composition_comparison'}
+_HIDE_YTICKS = {'bar_timeseries'}
 
 
 def micompanyify(data, highlight=-1, plottype=None, ascending=True, strfmt=None, **kwargs):
@@ -188,14 +306,17 @@ def micompanyify(data, highlight=-1, plottype=None, ascending=True, strfmt=None,
 
     data = data.squeeze() # DataFrame with single column should be treated as Series
     
+    is_pct = None
     if plottype is None:
-        plottype = pick_plottype(data)
+        plottype, is_pct = pick_plottype(data)
          
     orient = 'h' if plottype in ['bar_timeseries', 'line_timeseries'] else 'v'
     
     if strfmt is None:
-        if (isinstance(data, pd.DataFrame) and data.apply(is_percentage_series).all()) or\
-        (isinstance(data, pd.Series) and is_percentage_series(data)):
+        if is_pct is None:
+            is_pct = (isinstance(data, pd.DataFrame) and is_percentage_frame(data)) or\
+                     (isinstance(data, pd.Series) and is_percentage_series(data))
+        if is_pct:
             strfmt = '.1%'
         else:
             strfmt = '.2f'
@@ -207,63 +328,20 @@ def micompanyify(data, highlight=-1, plottype=None, ascending=True, strfmt=None,
         ascending = None
     
     if ascending is not None:
-        data = data.sort_values(ascending=ascending)   
+        is_sorted = data.is_monotonic_increasing if ascending else data.is_monotonic_decreasing
+        if not is_sorted:
+            data = data.sort_values(ascending=ascending)
     
-    if plottype == 'bar':
-        ax = data.plot(kind='barh', color=color, **kwargs)
-        if isinstance(data, pd.Series):
-            plot_values_above_bar(data, orient=orient, strfmt=strfmt)
-        else:
-            for i, col in enumerate(data.columns):
-                plot_values_above_bar(data[col], orient=orient, strfmt=strfmt,
-                                      bar_nr=i, nr_bars=len(data.columns))
-        
-    elif plottype == 'waterfall':
-        ax, data, blank = plot_waterfall(data, color=color, **kwargs)
-        plot_values_above_bar((data+blank), data, ax=ax, strfmt=strfmt, orient=orient)
-    elif plottype == 'waterfall_buildup':
-        ax, data, blank = plot_waterfall(data, color=color, buildup=True, **kwargs)
-        if pd.options.plotting.backend == 'matplotlib':
-            plot_values_above_bar((data+blank), data, ax=ax, strfmt=strfmt, orient=orient)
-        
-    elif plottype == 'bar_timeseries':
-        ax = data.plot(kind='bar', color=color, **kwargs)
-        if isinstance(data, pd.Series):
-            plot_values_above_bar(data, orient=orient, strfmt=strfmt)
-        else:
-            for i, col in enumerate(data.columns):
-                plot_values_above_bar(data[col], orient=orient, strfmt=strfmt,
-                                      bar_nr=i, nr_bars=len(data.columns))
+    try:
+        plot_function = _DISPATCH[plottype]
+    except KeyError:
+        raise NotImplementedError(f'plottype {plottype} not available, '
+                                  'choose "bar", or "waterfall"') from None
+    ax = plot_function(data, color, strfmt, orient, highlight, **kwargs)
     
-    elif plottype == 'line_timeseries':
-        ax = data.plot(color=color, **kwargs)
-        
-    elif plottype == 'scatter':
-        x = data.iloc[:, 0]
-        y = data.iloc[:, 1]
-        try:
-            size = data.iloc[:, 2]
-        except IndexError:
-            size = None
-        ax = sns.scatterplot(x=x, y=y, size=size, color='grey', **kwargs)
-    elif plottype == 'composition_comparison':
-        ax = data.transpose().plot(kind='barh', stacked=True, color=color, **kwargs)
-        data_begin = data.cumsum().shift().fillna(0)
-        data_end = data.cumsum()
-        location = data_begin.add(data_end).div(2)
-        if not isinstance(highlight, int):
-            raise TypeError('Can only highlight one line in composition comparison')
-   
-        plot_values_above_bar(location.iloc[highlight, :], data.iloc[highlight, :],
-                              textcolor='white', orient=orient, strfmt=strfmt)
-        
-    elif plottype == 'piechart':
-        raise TypeError('A piechart? Are you kidding me?')
-    else:
-        raise NotImplementedError(f'plottype {plottype} not available, choose "bar", or "waterfall"')
-    plt.box(False)
-    if orient == 'v' and plottype != 'scatter':
-        plt.xticks([])
-    elif orient == 'h' and plottype not in  ['line_timeseries', 'scatter']:
-        plt.yticks([])
+    ax.set_frame_on(False)
+    if plottype in _HIDE_XTICKS:
+        ax.set_xticks([])
+    elif plottype in _HIDE_YTICKS:
+        ax.set_yticks([])
     return ax